@@ -5,7 +5,7 @@ from click import ParamType
 from enum import Enum
 
 from click_completion.core import completion_configuration, get_code, install, shells, resolve_ctx, get_choices, \
-    startswith, Shell
+    startswith, Shell, _fast_match
 from click_completion.lib import get_auto_shell
 from click_completion.patch import patch as _patch
 
@@ -14,7 +14,7 @@ __version__ = '0.5.2'
 _initialized = False
 
 
-def init(complete_options=False, match_incomplete=None):
+def init(complete_options=False, match_incomplete=None, cache_ttl=0):
     """Initialize the enhanced click completion
 
     Parameters
@@ -24,11 +24,15 @@ def init(complete_options=False, match_incomplete=None):
     match_incomplete : func
         a function with two parameters choice and incomplete. Must return True
         if incomplete is a correct match for choice, False otherwise.
+    cache_ttl : float
+        the number of seconds the completion results are kept on disk to answer
+        the repeated completions of the same command line. (Default value = 0, no cache)
     """
     global _initialized
     if not _initialized:
         _patch()
         completion_configuration.complete_options = complete_options
+        completion_configuration.cache_ttl = cache_ttl
         if match_incomplete is not None:
             completion_configuration.match_incomplete = match_incomplete
         _initialized = True
@@ -43,7 +47,8 @@ class DocumentedChoice(ParamType):
     Parameters
     ----------
     choices : dict or Enum
-        A dictionary with the possible choice as key, and the corresponding help string as value
+        A dictionary with the possible choice as key, and the corresponding help string as value. The metavar and the
+        error message listing the choices are formatted once, when the type is created.
     """
     name = 'choice'
 
@@ -52,13 +57,15 @@ class DocumentedChoice(ParamType):
             self.choices = dict((choice.name, choice.value) for choice in choices)
         else:
             self.choices = dict(choices)
+        self._metavar = '[%s]' % '|'.join(self.choices.keys())
+        formated_choices = ['{:<12} {}'.format(k, self.choices[k] or '') for k in sorted(self.choices.keys())]
+        self._missing_message = 'Choose from\n  ' + '\n  '.join(formated_choices)
 
     def get_metavar(self, param):
-        return '[%s]' % '|'.join(self.choices.keys())
+        return self._metavar
 
     def get_missing_message(self, param):
-        formated_choices = ['{:<12} {}'.format(k, self.choices[k] or '') for k in sorted(self.choices.keys())]
-        return 'Choose from\n  ' + '\n  '.join(formated_choices)
+        return self._missing_message
 
     def convert(self, value, param, ctx):
         # Exact match
@@ -80,5 +87,8 @@ class DocumentedChoice(ParamType):
         return 'DocumentedChoice(%r)' % list(self.choices.keys())
 
     def complete(self, ctx, incomplete):
-        match = completion_configuration.match_incomplete
+        match = _fast_match(completion_configuration.match_incomplete)
+        if not incomplete and match is str.startswith:
+            # all the choices start with an empty string
+            return list(self.choices.items())
         return [(c, v) for c, v in self.choices.items() if match(c, incomplete)]
@@ -1,17 +1,49 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
-import distutils.version
+import functools
+import itertools
 import os
 import re
-import shlex
-import subprocess
+import sys
 
 import click
 from click import Option, Argument, MultiCommand, echo
 from enum import Enum
 
-from click_completion.lib import resolve_ctx, split_args, single_quote, double_quote, get_auto_shell
+from click_completion.lib import resolve_ctx, split_args, split_args_with_offsets, single_quote, double_quote, \
+    get_auto_shell, _split_args
+
+_bash_escape_re = re.compile(r"""([\s\\"'()])""")
+# same escaping as _bash_escape_re, for the ascii strings
+_bash_escape_table = dict((i, '\\' + chr(i)) for i in range(128) if _bash_escape_re.match(chr(i)))
+
+
+def _bash_escape(s):
+    """Escape the characters that bash would interpret in a completion result"""
+    if s.isascii():
+        return s.translate(_bash_escape_table)
+    return _bash_escape_re.sub(r'\\\1', s)
+
+
+_whitespace_re = re.compile(r'\s')
+# same replacement as _whitespace_re, for the ascii strings
+_whitespace_table = dict((i, ' ') for i in range(128) if _whitespace_re.match(chr(i)))
+
+
+def _replace_whitespaces(s):
+    """Replace all the whitespace characters by a space"""
+    if s.isascii():
+        return s.translate(_whitespace_table)
+    return _whitespace_re.sub(' ', s)
+
+
+_zsh_escape_table = str.maketrans({'"': '""', "'": "''", '$': '\\$', '`': '\\`'})
+
+
+def _zsh_escape(s):
+    """Escape a completion result to be put in a quoted string of the zsh _arguments specification"""
+    return s.translate(_zsh_escape_table)
 
 
 def startswith(string, incomplete):
@@ -46,20 +78,37 @@ class CompletionConfiguration:
         character.
     match_incomplete : func
         A function use to check whether a parameter match an incomplete argument typed by the user
+    cache_ttl : float
+        The number of seconds the completion results are kept on disk, in order to answer immediately when the user
+        hits tab several times on the same command line. The results are not kept when the value is 0, the default.
     """
     def __init__(self):
         self.complete_options = False
         self.match_incomplete = startswith
+        self.cache_ttl = 0
 
 
-def match(string, incomplete):
+def _fast_match(fn):
+    """Returns str.startswith in place of the default startswith function
+
+    Both give the same result, but str.startswith avoids the cost of a python function call per choice.
+    """
+    return str.startswith if fn is startswith else fn
+
+
+def _match_function():
+    """Returns the function used to match the choices with the incomplete argument"""
     import click_completion
     # backward compatibility handling
     if click_completion.startswith != startswith:
         fn = click_completion.startswith
     else:
         fn = completion_configuration.match_incomplete
-    return fn(string, incomplete)
+    return _fast_match(fn)
+
+
+def match(string, incomplete):
+    return _match_function()(string, incomplete)
 
 
 def get_choices(cli, prog_name, args, incomplete):
@@ -85,17 +134,21 @@ def get_choices(cli, prog_name, args, incomplete):
     ctx = resolve_ctx(cli, prog_name, args)
     if ctx is None:
         return
+    options = []
+    arguments = []
+    for param in ctx.command.get_params(ctx):
+        if isinstance(param, Option):
+            options.append(param)
+        elif isinstance(param, Argument):
+            arguments.append(param)
+    match = _match_function()
     optctx = None
     if args:
-        options = [param
-                   for param in ctx.command.get_params(ctx)
-                   if isinstance(param, Option)]
-        arguments = [param
-                     for param in ctx.command.get_params(ctx)
-                     if isinstance(param, Argument)]
-        for param in options:
-            if not param.is_flag and args[-1] in param.opts + param.secondary_opts:
-                optctx = param
+        # when several options share a name, the last one is used, as in click
+        options_by_name = dict((opt, param)
+                               for param in options if not param.is_flag
+                               for opt in itertools.chain(param.opts, param.secondary_opts))
+        optctx = options_by_name.get(args[-1])
         if optctx is None:
             for param in arguments:
                 if (
@@ -107,30 +160,98 @@ def get_choices(cli, prog_name, args, incomplete):
                 ):
                     optctx = param
                     break
-    choices = []
     if optctx:
-        choices += [c if isinstance(c, tuple) else (c, None) for c in optctx.type.complete(ctx, incomplete)]
+        for c in optctx.type.complete(ctx, incomplete):
+            yield c if isinstance(c, tuple) else (c, None)
     else:
-        for param in ctx.command.get_params(ctx):
-            if (completion_configuration.complete_options or incomplete and not incomplete[:1].isalnum()) and isinstance(param, Option):
-                # filter hidden click.Option
-                if getattr(param, 'hidden', False):
-                    continue
+        complete_options = completion_configuration.complete_options or incomplete and not incomplete[:1].isalnum()
+        if complete_options:
+            # filter hidden click.Option
+            visible_options = [param for param in options if not getattr(param, 'hidden', False)]
+            for param in visible_options:
                 for opt in param.opts:
                     if match(opt, incomplete):
-                        choices.append((opt, param.help))
+                        yield (opt, param.help)
                 for opt in param.secondary_opts:
                     if match(opt, incomplete):
                         # don't put the doc so fish won't group the primary and
                         # and secondary options
-                        choices.append((opt, None))
+                        yield (opt, None)
         if isinstance(ctx.command, MultiCommand):
             for name in ctx.command.list_commands(ctx):
                 if match(name, incomplete):
-                    choices.append((name, ctx.command.get_command_short_help(ctx, name)))
+                    yield (name, ctx.command.get_command_short_help(ctx, name))
+
+
+def _get_cache_path(prog_name):
+    """Returns the path of the file where the last completion results of a program are kept"""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'click-completion', '%s.cache' % prog_name)
 
-    for item, help in choices:
-        yield (item, help)
+
+def _get_cached_choices(cli, prog_name, args, incomplete):
+    """Returns the completion results, as get_choices, but keeps them on disk for a short time
+
+    The results are kept for completion_configuration.cache_ttl seconds, for the same program, working directory,
+    arguments and incomplete argument. A change of the program file is also detected through its modification time.
+    The cache is disabled when cache_ttl is 0. An unusable cache file is silently ignored.
+
+    Parameters
+    ----------
+    cli : click.Command
+        The main click Command of the program
+    prog_name : str
+        The program name on the command line
+    args : [str]
+        The arguments already written by the user on the command line
+    incomplete : str
+        The partial argument to complete
+
+    Returns
+    -------
+    [(str, str)]
+        A list of completion results
+    """
+    ttl = completion_configuration.cache_ttl
+    if not ttl:
+        return get_choices(cli, prog_name, args, incomplete)
+
+    import hashlib
+    import json
+    import tempfile
+    import time
+
+    try:
+        exe_mtime = os.stat(sys.argv[0]).st_mtime
+    except (OSError, IndexError):
+        exe_mtime = None
+    key = hashlib.blake2b(json.dumps([os.getcwd(), prog_name, exe_mtime, list(args), incomplete]).encode('utf-8'),
+                          digest_size=16).hexdigest()
+    path = _get_cache_path(prog_name)
+    try:
+        if time.time() - os.stat(path).st_mtime < ttl:
+            with open(path) as f:
+                cached = json.load(f)
+            if cached['key'] == key:
+                return [tuple(choice) for choice in cached['choices']]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    choices = list(get_choices(cli, prog_name, args, incomplete))
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write in a temporary file and rename it, so a concurrent completion never reads a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': key, 'choices': choices}, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except (OSError, TypeError, ValueError):
+        pass
+    return choices
 
 
 def do_bash_complete(cli, prog_name):
@@ -149,24 +270,22 @@ def do_bash_complete(cli, prog_name):
         True if the completion was successful, False otherwise
     """
     comp_words = os.environ['COMP_WORDS']
-    try:
-        cwords = shlex.split(comp_words)
-        quoted = False
-    except ValueError:  # No closing quotation
-        cwords = split_args(comp_words)
-        quoted = True
     cword = int(os.environ['COMP_CWORD'])
+    # the words after the one to complete are not needed
+    cwords, _, complete = _split_args(comp_words, cword + 1)
+    # the results must not be escaped inside an unclosed quotation
+    quoted = not complete
     args = cwords[1:cword]
     try:
         incomplete = cwords[cword]
     except IndexError:
         incomplete = ''
-    choices = get_choices(cli, prog_name, args, incomplete)
+    choices = _get_cached_choices(cli, prog_name, args, incomplete)
 
     if quoted:
-        echo('\t'.join(opt for opt, _ in choices), nl=False)
+        echo('\t'.join([opt for opt, _ in choices]), nl=False)
     else:
-        echo('\t'.join(re.sub(r"""([\s\\"'()])""", r'\\\1', opt) for opt, _ in choices), nl=False)
+        echo('\t'.join([_bash_escape(opt) for opt, _ in choices]), nl=False)
 
     return True
 
@@ -194,11 +313,14 @@ def do_fish_complete(cli, prog_name):
     else:
         incomplete = ''
 
-    for item, help in get_choices(cli, prog_name, args, incomplete):
+    res = []
+    for item, help in _get_cached_choices(cli, prog_name, args, incomplete):
         if help:
-            echo("%s\t%s" % (item, re.sub(r'\s', ' ', help)))
+            res.append("%s\t%s" % (item, _replace_whitespaces(help)))
         else:
-            echo(item)
+            res.append(item)
+    if res:
+        echo('\n'.join(res))
 
     return True
 
@@ -226,14 +348,12 @@ def do_zsh_complete(cli, prog_name):
     else:
         incomplete = ''
 
-    def escape(s):
-        return s.replace('"', '""').replace("'", "''").replace('$', '\\$').replace('`', '\\`')
     res = []
-    for item, help in get_choices(cli, prog_name, args, incomplete):
+    for item, help in _get_cached_choices(cli, prog_name, args, incomplete):
         if help:
-            res.append(r'"%s"\:"%s"' % (escape(item), escape(help)))
+            res.append(r'"%s"\:"%s"' % (_zsh_escape(item), _zsh_escape(help)))
         else:
-            res.append('"%s"' % escape(item))
+            res.append('"%s"' % _zsh_escape(item))
     if res:
         echo("_arguments '*: :((%s))'" % '\n'.join(res))
     else:
@@ -258,22 +378,103 @@ def do_powershell_complete(cli, prog_name):
         True if the completion was successful, False otherwise
     """
     commandline = os.environ['COMMANDLINE']
-    args = split_args(commandline)[1:]
+    args, offsets = split_args_with_offsets(commandline)
+    args = args[1:]
     quote = single_quote
     incomplete = ''
     if args and not commandline.endswith(' '):
         incomplete = args[-1]
         args = args[:-1]
-        quote_pos = commandline.rfind(incomplete) - 1
-        if quote_pos >= 0 and commandline[quote_pos] == '"':
+        if commandline[offsets[-1]] == '"':
             quote = double_quote
 
-    for item, help in get_choices(cli, prog_name, args, incomplete):
-        echo(quote(item))
+    res = [quote(item) for item, help in _get_cached_choices(cli, prog_name, args, incomplete)]
+    if res:
+        echo('\n'.join(res))
 
     return True
 
 
+_jinja_env = None
+_templates = {}
+# the expressions of the templates that can be rendered without jinja
+_plain_template_re = re.compile(r'{{\s*(prog_name|prog_name\.upper\(\)|complete_var)\s*}}')
+_plain_templates = {}
+
+
+def _get_template_name(shell):
+    """Returns the name of the completion code template of a shell for the installed click version"""
+    if int(click.__version__.split('.')[0]) >= 8:
+        return '%s-click8.j2' % shell.name
+    return '%s.j2' % shell.name
+
+
+def _get_template(shell):
+    """Returns the jinja template of the completion code for a shell
+
+    The jinja environment and the compiled templates are kept for the whole process.
+
+    Parameters
+    ----------
+    shell : Shell
+        The shell type
+
+    Returns
+    -------
+    jinja2.Template
+        The template of the completion code
+    """
+    global _jinja_env
+    template = _templates.get(shell)
+    if template is None:
+        if _jinja_env is None:
+            from jinja2 import Environment, FileSystemLoader
+            _jinja_env = Environment(loader=FileSystemLoader(os.path.dirname(__file__)), auto_reload=False)
+        template = _templates[shell] = _jinja_env.get_template(_get_template_name(shell))
+    return template
+
+
+def _get_plain_template(shell):
+    """Returns the completion code template of a shell when it can be rendered without jinja
+
+    This is the case of the templates that only substitute the program name and the completion variable, without any
+    control flow. Rendering them by simple substitution saves the import of jinja.
+
+    Parameters
+    ----------
+    shell : Shell
+        The shell type
+
+    Returns
+    -------
+    str
+        The source of the template, or None when the template must be rendered with jinja
+    """
+    if shell not in _plain_templates:
+        try:
+            with open(os.path.join(os.path.dirname(__file__), _get_template_name(shell))) as f:
+                source = f.read()
+        except OSError:
+            source = None
+        if source is not None:
+            if '{%' in source or '{#' in source or '{{' in _plain_template_re.sub('', source):
+                source = None
+            elif source.endswith('\n'):
+                # jinja drops the trailing newline of the templates
+                source = source[:-1]
+        _plain_templates[shell] = source
+    return _plain_templates[shell]
+
+
+def _render(shell, prog_name, env_name, extra_env):
+    """Renders the completion code template of a shell"""
+    source = _get_plain_template(shell)
+    if source is None:
+        return _get_template(shell).render(prog_name=prog_name, complete_var=env_name, extra_env=extra_env)
+    values = {'prog_name': prog_name, 'prog_name.upper()': prog_name.upper(), 'complete_var': env_name}
+    return _plain_template_re.sub(lambda m: values[m.group(1)], source)
+
+
 def get_code(shell=None, prog_name=None, env_name=None, extra_env=None):
     """Returns the completion code to be evaluated by the shell
 
@@ -293,7 +494,6 @@ def get_code(shell=None, prog_name=None, env_name=None, extra_env=None):
     str
         The code to be evaluated by the shell
     """
-    from jinja2 import Environment, FileSystemLoader
     if shell in [None, 'auto']:
         shell = get_auto_shell()
     if not isinstance(shell, Shell):
@@ -301,17 +501,30 @@ def get_code(shell=None, prog_name=None, env_name=None, extra_env=None):
     prog_name = prog_name or click.get_current_context().find_root().info_name
     env_name = env_name or '_%s_COMPLETE' % prog_name.upper().replace('-', '_')
     extra_env = extra_env if extra_env else {}
-    env = Environment(loader=FileSystemLoader(os.path.dirname(__file__)))
+    extra_env_items = tuple(extra_env.items())
+    try:
+        hash(extra_env_items)
+    except TypeError:  # unhashable value in extra_env
+        return _render(shell, prog_name, env_name, extra_env)
+    return _render_code(shell, prog_name, env_name, extra_env_items)
 
-    click_ver = distutils.version.StrictVersion(click.__version__)
-    click8_ver = distutils.version.StrictVersion('8.0.0')
-    if click_ver >= click8_ver:
-        template_name = '%s-click8.j2'
-    else:
-        template_name = '%s.j2'
-    template = env.get_template(template_name % shell.name)
 
-    return template.render(prog_name=prog_name, complete_var=env_name, extra_env=extra_env)
+@functools.lru_cache(maxsize=32)
+def _render_code(shell, prog_name, env_name, extra_env_items):
+    """Renders the completion code template, keeping the last results
+
+    The extra environment variables are passed as a tuple of (name, value) items, in order to be hashable and to keep
+    their order in the generated code.
+    """
+    return _render(shell, prog_name, env_name, dict(extra_env_items))
+
+
+# the default installation path, relative to the home directory, and the default file mode of the shells, by name
+_install_defaults = {
+    'fish': (os.path.join('.config', 'fish', 'completions', '%(prog_name)s.fish'), 'w'),
+    'bash': ('.bash_completion', 'a'),
+    'zsh': ('.zshrc', 'a'),
+}
 
 
 def install(shell=None, prog_name=None, env_name=None, path=None, append=None, extra_env=None):
@@ -338,6 +551,10 @@ def install(shell=None, prog_name=None, env_name=None, path=None, append=None, e
     """
     prog_name = prog_name or click.get_current_context().find_root().info_name
     shell = shell or get_auto_shell()
+    if not isinstance(shell, Shell):
+        if shell not in Shell.__members__:
+            raise click.ClickException('%s is not supported.' % shell)
+        shell = Shell[shell]
     if append is None and path is not None:
         append = True
     if append is not None:
@@ -345,38 +562,29 @@ def install(shell=None, prog_name=None, env_name=None, path=None, append=None, e
     else:
         mode = None
 
-    if shell == 'fish':
-        path = path or os.path.expanduser('~') + '/.config/fish/completions/%s.fish' % prog_name
-        mode = mode or 'w'
-    elif shell == 'bash':
-        path = path or os.path.expanduser('~') + '/.bash_completion'
-        mode = mode or 'a'
-    elif shell == 'zsh':
-        zdotdir = os.getenv('ZDOTDIR')
-        if zdotdir is None:
-            path = path or os.path.expanduser('~') + '/.zshrc'
-        else:
-            path = path or zdotdir + '/.zshrc'
-        mode = mode or 'a'
-    elif shell == 'powershell':
-        subprocess.check_call(['powershell', 'Set-ExecutionPolicy Unrestricted -Scope CurrentUser'])
-        path = path or subprocess.check_output(['powershell', '-NoProfile', 'echo $profile']).strip() if install else ''
+    if shell.name in _install_defaults:
+        default_path, default_mode = _install_defaults[shell.name]
+        # zsh reads its configuration in ZDOTDIR when it is set
+        base_dir = os.getenv('ZDOTDIR') if shell is Shell.zsh else None
+        path = path or os.path.join(base_dir or os.path.expanduser('~'), default_path % {'prog_name': prog_name})
+        mode = mode or default_mode
+    elif shell is Shell.powershell:
+        import subprocess
+        try:
+            subprocess.check_call(['powershell', 'Set-ExecutionPolicy Unrestricted -Scope CurrentUser'])
+            path = path or subprocess.check_output(['powershell', '-NoProfile', 'echo $profile']).strip()
+        except FileNotFoundError:
+            raise click.ClickException('powershell is not available.')
         mode = mode or 'a'
     else:
-        raise click.ClickException('%s is not supported.' % shell)
+        raise click.ClickException('%s is not supported.' % shell.name)
 
-    if append is not None:
-        mode = 'a' if append else 'w'
-    else:
-        mode = mode
     d = os.path.dirname(path)
-    if not os.path.exists(d):
-        os.makedirs(d)
-    f = open(path, mode)
-    f.write(get_code(shell, prog_name, env_name, extra_env))
-    f.write("\n")
-    f.close()
-    return shell, path
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path, mode) as f:
+        f.write(get_code(shell, prog_name, env_name, extra_env) + "\n")
+    return shell.name, path
 
 
 class Shell(Enum):
@@ -2,16 +2,14 @@
 # -*- coding:utf-8 -*-
 
 import re
-import shlex
 
 import click
-import shellingham
 from click import MultiCommand
 
 find_unsafe = re.compile(r'[^\w@%+=:,./-]').search
 
 
-def single_quote(s):
+def single_quote(s, _find_unsafe=find_unsafe):
     """Escape a string with single quotes in order to be parsed as a single element by shlex
 
     Parameters
@@ -26,7 +24,8 @@ def single_quote(s):
     """
     if not s:
         return "''"
-    if find_unsafe(s) is None:
+    # the alphanumeric strings are the most common safe strings, and are much faster to check without the regex
+    if s.isalnum() or _find_unsafe(s) is None:
         return s
 
     # use single quotes, and put single quotes into double quotes
@@ -34,7 +33,7 @@ def single_quote(s):
     return "'" + s.replace("'", "'\"'\"'") + "'"
 
 
-def double_quote(s):
+def double_quote(s, _find_unsafe=find_unsafe):
     """Escape a string with double quotes in order to be parsed as a single element by shlex
 
     Parameters
@@ -49,7 +48,7 @@ def double_quote(s):
     """
     if not s:
         return '""'
-    if find_unsafe(s) is None:
+    if s.isalnum() or _find_unsafe(s) is None:
         return s
 
     # use double quotes, and put double quotes into single quotes
@@ -75,7 +74,7 @@ def resolve_ctx(cli, prog_name, args, resilient_parsing=True):
         A new context corresponding to the current command
     """
     ctx = cli.make_context(prog_name, list(args), resilient_parsing=resilient_parsing)
-    while ctx.args + ctx.protected_args and isinstance(ctx.command, MultiCommand):
+    while (ctx.args or ctx.protected_args) and isinstance(ctx.command, MultiCommand):
         a = ctx.protected_args + ctx.args
         cmd = ctx.command.get_command(ctx, a[0])
         if cmd is None:
@@ -89,6 +88,17 @@ def resolve_ctx(cli, prog_name, args, resilient_parsing=True):
     return ctx
 
 
+# the pieces of a command line, as seen by shlex in posix mode with whitespace_split
+_split_args_re = re.compile(r"""
+    (?P<space>[ \t\r\n]+)
+    |(?P<word>[^ \t\r\n'"\\]+)
+    |'(?P<single>[^']*)(?P<single_end>'?)
+    |"(?P<double>(?:[^"\\]|\\.)*\\?)(?P<double_end>"?)
+    |\\(?P<escaped>.?)
+""", re.VERBOSE | re.DOTALL)
+_double_quote_escape_re = re.compile(r'\\(["\\]|\Z)')
+
+
 def split_args(line):
     """Version of shlex.split that silently accept incomplete strings.
 
@@ -102,22 +112,79 @@ def split_args(line):
     [str]
         The line split in separated arguments
     """
-    lex = shlex.shlex(line, posix=True)
-    lex.whitespace_split = True
-    lex.commenters = ''
+    return _split_args(line)[0]
+
+
+def split_args_with_offsets(line):
+    """Version of split_args that also returns the position of the arguments in the line
+
+    Parameters
+    ----------
+    line : str
+        The string to split
+
+    Returns
+    -------
+    ([str], [int])
+        The line split in separated arguments, and the index in line of the first character of each argument
+    """
+    return _split_args(line)[:2]
+
+
+def _split_args(line, max_args=None):
+    """Splits the line like split_args_with_offsets, and also tells whether the line is complete
+
+    The line is incomplete when it ends inside a quoted string or right after an escaping backslash. This is the
+    case where shlex.split raises a ValueError. When max_args is given, the split stops after that many arguments, and
+    the rest of the line is ignored.
+    """
     res = []
-    try:
-        while True:
-            res.append(next(lex))
-    except ValueError:  # No closing quotation
-        pass
-    except StopIteration:  # End of loop
-        pass
-    if lex.token:
-        res.append(lex.token)
-    return res
+    offsets = []
+    token = []
+    quoted = False
+    start = 0
+    for m in _split_args_re.finditer(line):
+        kind = m.lastgroup
+        if kind == 'space':
+            if token or quoted:
+                res.append(''.join(token))
+                offsets.append(start)
+                if len(res) == max_args:
+                    return res, offsets, True
+            token = []
+            quoted = False
+            start = m.end()
+        elif kind == 'word':
+            token.append(m.group(kind))
+        elif kind == 'escaped':
+            if not m.group(kind):  # No escaped character
+                break
+            token.append(m.group(kind))
+        elif kind == 'single_end':
+            token.append(m.group('single'))
+            quoted = True
+            if not m.group(kind):  # No closing quotation
+                break
+        else:
+            # only the double quote and the backslash can be escaped in a double quoted string
+            token.append(_double_quote_escape_re.sub(r'\1', m.group('double')))
+            quoted = True
+            if not m.group(kind):  # No closing quotation
+                break
+    else:
+        if token or quoted:
+            res.append(''.join(token))
+            offsets.append(start)
+        return res, offsets, True
+    # incomplete string
+    token = ''.join(token)
+    if token:
+        res.append(token)
+        offsets.append(start)
+    return res, offsets, False
 
 
 def get_auto_shell():
     """Returns the current shell"""
+    import shellingham
     return shellingham.detect_shell()[0]
@@ -8,7 +8,7 @@ import click
 from click import echo
 
 from click_completion.core import do_bash_complete, do_fish_complete, do_zsh_complete, do_powershell_complete,\
-    get_code, install, completion_configuration
+    get_code, install, completion_configuration, _fast_match
 
 """All the code used to monkey patch click"""
 
@@ -49,10 +49,11 @@ def choice_complete(self, ctx, incomplete):
     [(str, str)]
         A list of completion results
     """
-    return [
-        (c, None) for c in self.choices
-        if completion_configuration.match_incomplete(c, incomplete)
-    ]
+    match = _fast_match(completion_configuration.match_incomplete)
+    if not incomplete and match is str.startswith:
+        # all the choices start with an empty string
+        return [(c, None) for c in self.choices]
+    return [(c, None) for c in self.choices if match(c, incomplete)]
 
 
 def multicommand_get_command_short_help(self, ctx, cmd_name):
@@ -98,6 +99,32 @@ def multicommand_get_command_hidden(self, ctx, cmd_name):
     return cmd.hidden if cmd else False
 
 
+_complete_functions = {
+    # keep 'complete' for bash for backward compatibility
+    'complete': do_bash_complete,
+    'complete-bash': do_bash_complete,
+    'complete-fish': do_fish_complete,
+    'complete-powershell': do_powershell_complete,
+    'complete-zsh': do_zsh_complete,
+}
+
+_source_shells = {
+    'source': None,
+    'source-bash': 'bash',
+    'source-fish': 'fish',
+    'source-powershell': 'powershell',
+    'source-zsh': 'zsh',
+}
+
+_install_shells = {
+    'install': None,
+    'install-bash': 'bash',
+    'install-fish': 'fish',
+    'install-powershell': 'powershell',
+    'install-zsh': 'zsh',
+}
+
+
 def _shellcomplete(cli, prog_name, complete_var=None):
     """Internal handler for the bash completion support.
 
@@ -116,39 +143,12 @@ def _shellcomplete(cli, prog_name, complete_var=None):
     if not complete_instr:
         return
 
-    if complete_instr == 'source':
-        echo(get_code(prog_name=prog_name, env_name=complete_var))
-    elif complete_instr == 'source-bash':
-        echo(get_code('bash', prog_name, complete_var))
-    elif complete_instr == 'source-fish':
-        echo(get_code('fish', prog_name, complete_var))
-    elif complete_instr == 'source-powershell':
-        echo(get_code('powershell', prog_name, complete_var))
-    elif complete_instr == 'source-zsh':
-        echo(get_code('zsh', prog_name, complete_var))
-    elif complete_instr in ['complete', 'complete-bash']:
-        # keep 'complete' for bash for backward compatibility
-        do_bash_complete(cli, prog_name)
-    elif complete_instr == 'complete-fish':
-        do_fish_complete(cli, prog_name)
-    elif complete_instr == 'complete-powershell':
-        do_powershell_complete(cli, prog_name)
-    elif complete_instr == 'complete-zsh':
-        do_zsh_complete(cli, prog_name)
-    elif complete_instr == 'install':
-        shell, path = install(prog_name=prog_name, env_name=complete_var)
-        click.echo('%s completion installed in %s' % (shell, path))
-    elif complete_instr == 'install-bash':
-        shell, path = install(shell='bash', prog_name=prog_name, env_name=complete_var)
-        click.echo('%s completion installed in %s' % (shell, path))
-    elif complete_instr == 'install-fish':
-        shell, path = install(shell='fish', prog_name=prog_name, env_name=complete_var)
-        click.echo('%s completion installed in %s' % (shell, path))
-    elif complete_instr == 'install-zsh':
-        shell, path = install(shell='zsh', prog_name=prog_name, env_name=complete_var)
-        click.echo('%s completion installed in %s' % (shell, path))
-    elif complete_instr == 'install-powershell':
-        shell, path = install(shell='powershell', prog_name=prog_name, env_name=complete_var)
+    if complete_instr in _complete_functions:
+        _complete_functions[complete_instr](cli, prog_name)
+    elif complete_instr in _source_shells:
+        echo(get_code(_source_shells[complete_instr], prog_name, complete_var))
+    elif complete_instr in _install_shells:
+        shell, path = install(shell=_install_shells[complete_instr], prog_name=prog_name, env_name=complete_var)
         click.echo('%s completion installed in %s' % (shell, path))
     sys.exit()
 
@@ -2,15 +2,14 @@
 # -*- coding:utf-8 -*-
 
 import ast
-import re
 
 from setuptools import setup, find_packages
 
-_version_re = re.compile(r'__version__\s+=\s+(.*)')
-
-with open('click_completion/__init__.py', 'rb') as f:
-    version = str(ast.literal_eval(_version_re.search(
-        f.read().decode('utf-8')).group(1)))
+with open('click_completion/__init__.py', encoding='utf-8') as f:
+    for line in f:
+        if line.startswith('__version__'):
+            version = str(ast.literal_eval(line.split('=', 1)[1].strip()))
+            break
 
 setup(
     name='click-completion',